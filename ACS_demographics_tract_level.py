@@ -5,6 +5,8 @@
 import pandas as pd
 import requests
 import os
+import json
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
@@ -20,6 +22,53 @@ ACS_VARS = {
     "B19013_001E": "median_income"
 }
 
+# Local copy of the last Census API response, reused for up to a week
+ACS_CACHE_FILE = os.path.join(OUTPUT_DIR, "_acs_cache.json")
+ACS_CACHE_MAX_AGE_SEC = 7 * 24 * 3600
+
+
+def fetch_census_json(url):
+    """
+    Returns the Census API JSON for url, served from the local cache when it
+    is fresh. Stale entries are revalidated with a conditional GET.
+    """
+    cache = None
+    if os.path.exists(ACS_CACHE_FILE):
+        with open(ACS_CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache.get("url") != url:
+            cache = None
+
+    if cache and time.time() - os.path.getmtime(ACS_CACHE_FILE) < ACS_CACHE_MAX_AGE_SEC:
+        print(f"Using cached Census response from '{ACS_CACHE_FILE}'.")
+        return cache["data"]
+
+    headers = {}
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache and cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304 and cache:
+        print("Census data unchanged; using cached response.")
+        os.utime(ACS_CACHE_FILE)
+        return cache["data"]
+
+    response.raise_for_status()
+    data = response.json()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(ACS_CACHE_FILE, "w") as f:
+        json.dump({
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "data": data,
+        }, f)
+
+    return data
+
 
 # ---CONSTRUCT AND EXECUTE CENSUS API CALL ---
 print("Requesting data from the US Census API...")
@@ -28,10 +77,15 @@ print("Requesting data from the US Census API...")
 var_string = ",".join(ACS_VARS.keys())
 api_url = f"https://api.census.gov/data/2022/acs/acs5?get={var_string},NAME&for=tract:*&in=state:36"
 
-# Make the request and convert the JSON response to a DataFrame
-response = requests.get(api_url)
-data = response.json()
-df_acs = pd.DataFrame(data[1:], columns=data[0])
+# Make the request (or reuse the cache) and convert the JSON response to a DataFrame
+data = fetch_census_json(api_url)
+df_acs = pd.DataFrame.from_records(data[1:], columns=data[0])
+
+# Parse the numeric variables once. The API returns negative values for
+# missing/suppressed data, so we turn those into NaN (Not a Number).
+acs_cols = list(ACS_VARS)
+df_acs = df_acs.astype({col: 'float32' for col in acs_cols})
+df_acs[acs_cols] = df_acs[acs_cols].where(lambda x: x >= 0)
 
 print(f"Data for {len(df_acs)} tracts in NY State loaded successfully.")
 
@@ -71,12 +125,6 @@ county_to_borough_digit = {
 df_acs_nyc['tract_id'] = df_acs_nyc['county'].map(county_to_borough_digit) + df_acs_nyc['tract']
 print("Custom tract IDs created.")
 
-# Convert population and income to numeric types.
-# The API returns negative values for missing/suppressed data, so we'll turn those into NaN (Not a Number).
-for col in ['total_population', 'median_income']:
-    df_acs_nyc[col] = pd.to_numeric(df_acs_nyc[col], errors='coerce')
-    df_acs_nyc.loc[df_acs_nyc[col] < 0, col] = None # Set negative values to NaN
-
 # Keep only the essential, final columns
 df_final = df_acs_nyc[['tract_id', 'total_population', 'median_income']]
 print("Data cleaned and formatted.")
@@ -137,15 +185,18 @@ print("Cleaned ACS dataframe.")
 # In[21]:
 
 
-acs["income_weight"] = 1 / acs["median_income"]
-acs["income_weight"] = (acs["income_weight"] - acs["income_weight"].min()) / \
-                       (acs["income_weight"].max() - acs["income_weight"].min())
-acs["income_weight"] = 0.5 + acs["income_weight"] * 1.5  # Scale between 0.5–2.0
+# Compute weights on the raw arrays to avoid intermediate Series
+inc = acs["median_income"].to_numpy(dtype=np.float32)
+pop = acs["total_population"].to_numpy(dtype=np.float32)
+
+income_weight = 1.0 / inc
+income_weight = (income_weight - income_weight.min()) / (income_weight.max() - income_weight.min())
+income_weight = 0.5 + income_weight * 1.5  # Scale between 0.5–2.0
 
-acs["pop_weight"] = acs["total_population"] / acs["total_population"].max()
+pop_weight = pop / pop.max()
 
 # Combine into one equity weight vector
-acs["equity_weight"] = 0.5 * acs["income_weight"] + 0.5 * acs["pop_weight"]
+acs["equity_weight"] = 0.5 * income_weight + 0.5 * pop_weight
 
 # Save cleaned ACS data
 acs.to_csv("output/ACS_cleaned_equity.csv", index=False)
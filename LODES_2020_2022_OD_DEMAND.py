@@ -3,9 +3,8 @@
 
 import os
 import pandas as pd
+import polars as pl
 import matplotlib.pyplot as plt
-import csv
-from tqdm import tqdm
 import time
 import requests
 
@@ -17,7 +16,7 @@ BASE_URL = f"https://lehd.ces.census.gov/data/lodes/LODES8/{STATE}/od/{STATE}_od
 
 OUTPUT_DIR = "output"
 IMAGES_DIR = "images"
-OD_MATRIX_FILE_SUM = "OD_demand_LODES.csv"
+OD_MATRIX_FILE_SUM = "OD_demand_LODES.parquet"
 TOP_N = 15
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -60,6 +59,34 @@ def get_file_size(url):
     except:
         return None
 
+
+def tract_id_expr(geocode_col):
+    """Custom 7-digit tract ID: borough digit + 6-digit tract code."""
+    return pl.concat_str([
+        pl.col(geocode_col).str.slice(0, 5).replace_strict(county_to_borough_digit),
+        pl.col(geocode_col).str.slice(5, 6),
+    ])
+
+
+def lodes_year_query(url):
+    """Lazy Polars query summing NYC-to-NYC jobs (S000) per tract pair."""
+    return (
+        pl.scan_csv(url, schema_overrides={"h_geocode": pl.Utf8, "w_geocode": pl.Utf8, "S000": pl.Int32})
+        .select(["h_geocode", "w_geocode", "S000"])
+        .filter(
+            pl.col("h_geocode").str.slice(0, 5).is_in(nyc_county_fips) &
+            pl.col("w_geocode").str.slice(0, 5).is_in(nyc_county_fips)
+        )
+        .with_columns(
+            tract_id_expr("h_geocode").alias("origin_tract"),
+            tract_id_expr("w_geocode").alias("destination_tract"),
+            pl.col("S000").fill_null(0),
+        )
+        .group_by(["origin_tract", "destination_tract"])
+        .agg(pl.col("S000").sum())
+    )
+
+
 for y in YEARS:
     url = BASE_URL.format(year=y)
     print(f"\nLoading {y} from {url}")
@@ -76,55 +103,13 @@ for y in YEARS:
     t0 = time.time()
 
     try:
-        # Load compressed CSV in chunks to avoid memory spikes
-        chunks = pd.read_csv(url, dtype=str, chunksize=1_000_000)
-
-        year_sum = {}
-
-        # Wrap chunks inside tqdm
-        for chunk in tqdm(chunks, desc=f"   Processing {y}", unit="chunk"):
-
-            # Filter to NYC boroughs
-            chunk = chunk[
-                chunk['h_geocode'].astype(str).str[:5].isin(nyc_county_fips) &
-                chunk['w_geocode'].astype(str).str[:5].isin(nyc_county_fips)
-            ].copy()
-
-            if chunk.empty:
-                continue
-
-            # Convert job count
-            chunk['S000'] = (
-                pd.to_numeric(chunk['S000'], errors='coerce')
-                .fillna(0)
-                .astype('int32')
-            )
-
-            # Build custom tract IDs
-            chunk['origin_tract'] = (
-                chunk['h_geocode'].astype(str).str[:5].map(county_to_borough_digit)
-                + chunk['h_geocode'].astype(str).str[5:11]
-            )
-            chunk['destination_tract'] = (
-                chunk['w_geocode'].astype(str).str[:5].map(county_to_borough_digit)
-                + chunk['w_geocode'].astype(str).str[5:11]
-            )
-
-            # Aggregate within chunk
-            agg = chunk.groupby(
-                ['origin_tract', 'destination_tract']
-            )['S000'].sum()
-
-            # Merge chunk sums into running dictionary
-            for (o, d), val in agg.items():
-                key = (o, d)
-                year_sum[key] = year_sum.get(key, 0) + val
-
-        # Append yearly totals into master DataFrame
-        df_year = pd.DataFrame(
-            [(o, d, v) for (o, d), v in year_sum.items()],
-            columns=["origin_tract", "destination_tract", "S000"]
-        )
+        # Filter, remap and aggregate the whole year in one streaming query
+        df_year = lodes_year_query(url).collect(engine="streaming").to_pandas()
+
+        if df_year.empty:
+            print(f"   Finished {y}: no NYC OD pairs found.")
+            continue
+
         od_matrix_total = pd.concat([od_matrix_total, df_year], ignore_index=True)
 
         print(f"   Finished {y}: {len(df_year):,} OD pairs loaded.")
@@ -145,8 +130,16 @@ print("===============================================================")
 # --- COMBINE AND SUM ACROSS ALL YEARS ---
 print("\nSumming across all available years (2020–2022)...")
 
+# Share one categorical dtype across both tract columns so the groupby
+# hashes small integer codes instead of strings
+tract_cols = ['origin_tract', 'destination_tract']
+tract_dtype = pd.CategoricalDtype(
+    categories=sorted(pd.unique(od_matrix_total[tract_cols].to_numpy().ravel()))
+)
+od_matrix_total[tract_cols] = od_matrix_total[tract_cols].astype(tract_dtype)
+
 od_matrix_sum = (
-    od_matrix_total.groupby(['origin_tract', 'destination_tract'])['S000']
+    od_matrix_total.groupby(tract_cols, observed=True)['S000']
     .sum()
     .reset_index()
     .rename(columns={'S000': 'total_commuters_2020_2022'})
@@ -159,10 +152,11 @@ print(f"Combined OD matrix ready: {len(od_matrix_sum):,} total OD pairs.")
 
 
 # --- SAVE FINAL OUTPUT ---
-print("\n Saving output to CSV...")
+print("\n Saving output to Parquet...")
 
 output_path = os.path.join(OUTPUT_DIR, OD_MATRIX_FILE_SUM)
-od_matrix_sum.to_csv(output_path, index=False)
+od_matrix_sum[tract_cols] = od_matrix_sum[tract_cols].astype('string')
+od_matrix_sum.to_parquet(output_path, engine="pyarrow", compression="zstd", index=False)
 
 print(f"Saved aggregated OD matrix to: {output_path}")
 print("\nPreview:")
@@ -175,56 +169,55 @@ print(od_matrix_sum.head())
 print("\nFiltering OD pairs (drop self and neighbors)")
 
 # Paths
-od_path = os.path.join(OUTPUT_DIR, "OD_demand_LODES.csv")
+od_path = os.path.join(OUTPUT_DIR, OD_MATRIX_FILE_SUM)
 neighbors_csv_path = os.path.join(OUTPUT_DIR, "nyc_tract_neighbors_1mile.csv")
-filtered_path = os.path.join(OUTPUT_DIR, "OD_demand_LODES_nonneighbors.csv")
+filtered_path = os.path.join(OUTPUT_DIR, "OD_demand_LODES_nonneighbors.parquet")
 
 # --- Load OD matrix and normalize IDs ---
-df_od = pd.read_csv(od_path, dtype=str)
+df_od = pd.read_parquet(od_path)
 for col in ("origin_tract", "destination_tract"):
-    df_od[col] = df_od[col].astype(str).str.extract(r"(\d+)")[0].str.zfill(7)
+    df_od[col] = df_od[col].astype("string").str.zfill(7)
 
 print(f"Loaded OD matrix: {len(df_od):,} rows")
 
 # --- Load neighbors into dictionary of sets ---
-neighbors_dict = {}
-with open(neighbors_csv_path, "r") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        tid = str(row["tract_id"]).zfill(7)
-        nlist = [n.strip().zfill(7) for n in row["neighbor_ids"].split(",") if n.strip()]
-        neighbors_dict[tid] = set(nlist)
+nb = pd.read_csv(neighbors_csv_path, dtype=str)
+nb["neighbor_ids"] = nb["neighbor_ids"].str.split(",")
+nb = nb.explode("neighbor_ids")
+nb["neighbor_ids"] = nb["neighbor_ids"].str.strip()
+nb = nb[nb["neighbor_ids"].fillna("") != ""]
+nb["tract_id"] = nb["tract_id"].str.zfill(7)
+nb["neighbor_ids"] = nb["neighbor_ids"].str.zfill(7)
+nb = nb.drop_duplicates()
+
+neighbors_dict = nb.groupby("tract_id")["neighbor_ids"].apply(set).to_dict()
 
 print(f"Loaded {len(neighbors_dict):,} neighbor lists")
 
 # --- Filter out OD pairs that are (a) self-pairs, or (b) within 1 mile ---
-mask = []
-removed_self = removed_neighbor = 0
-
-for o, d in tqdm(zip(df_od["origin_tract"], df_od["destination_tract"]),
-                 total=len(df_od), desc="Filtering OD pairs"):
-    if o == d:
-        removed_self += 1
-        mask.append(False)
-    elif d in neighbors_dict.get(o, set()):
-        removed_neighbor += 1
-        mask.append(False)
-    else:
-        mask.append(True)
+df_nbr = nb.rename(columns={"tract_id": "origin", "neighbor_ids": "neighbor"})
+matched = df_od.merge(
+    df_nbr,
+    left_on=["origin_tract", "destination_tract"],
+    right_on=["origin", "neighbor"],
+    how="left", indicator=True
+)
+
+is_self = (matched["origin_tract"] == matched["destination_tract"]).to_numpy()
+is_neighbor = (matched["_merge"] == "both").to_numpy() & ~is_self
+removed_self = int(is_self.sum())
+removed_neighbor = int(is_neighbor.sum())
 
-df_filtered = df_od[mask].reset_index(drop=True)
+df_filtered = df_od[~(is_self | is_neighbor)].reset_index(drop=True)
 print(f"Removed self-pairs: {removed_self:,}")
 print(f"Removed neighbor pairs: {removed_neighbor:,}")
 print(f"Kept {len(df_filtered):,} of {len(df_od):,} OD rows")
 
-# --- Convert commuter counts to numeric and sort descending ---
-df_filtered["total_commuters_2020_2022"] = pd.to_numeric(
-    df_filtered["total_commuters_2020_2022"], errors="coerce"
-)
+# --- Sort descending by commuter count ---
 df_filtered = df_filtered.sort_values("total_commuters_2020_2022", ascending=False)
 
 # --- Save filtered and sorted results ---
-df_filtered.to_csv(filtered_path, index=False)
+df_filtered.to_parquet(filtered_path, engine="pyarrow", compression="zstd", index=False)
 print(f"Saved filtered & sorted file to: {filtered_path}")
 
 # --- Sanity check ---
@@ -240,12 +233,8 @@ print(df_filtered.head(10))
 print("\nAnalyzing how much commuter volume was removed...")
 
 # Reload both (in case previous df_od and df_filtered aren't in memory)
-df_od = pd.read_csv(os.path.join(OUTPUT_DIR, "OD_demand_LODES.csv"))
-df_filtered = pd.read_csv(os.path.join(OUTPUT_DIR, "OD_demand_LODES_nonneighbors.csv"))
-
-# Ensure numeric
-df_od['total_commuters_2020_2022'] = pd.to_numeric(df_od['total_commuters_2020_2022'], errors='coerce').fillna(0)
-df_filtered['total_commuters_2020_2022'] = pd.to_numeric(df_filtered['total_commuters_2020_2022'], errors='coerce').fillna(0)
+df_od = pd.read_parquet(od_path)
+df_filtered = pd.read_parquet(filtered_path)
 
 # Total commuters before and after
 total_before = df_od['total_commuters_2020_2022'].sum()
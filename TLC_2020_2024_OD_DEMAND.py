@@ -4,12 +4,17 @@
 import pandas as pd
 import os
 import time
+from datetime import timedelta
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import pyarrow.parquet as pq
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import numpy as np
 import matplotlib.pyplot as plt
-import csv
 from tqdm import tqdm
 
 # ======================================================================
@@ -18,16 +23,12 @@ from tqdm import tqdm
 
 CROSSWALK_FILE = "output/nyc_zone_tract_crosswalk.csv"
 OUTPUT_DIR = "output"
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, "OD_demand_TLC.csv")
+OUTPUT_FILE = os.path.join(OUTPUT_DIR, "OD_demand_TLC.parquet")
 
 total_bytes_downloaded = 0
 
+# Only the zone IDs are materialized; filter columns are read inside the scan
 COLUMNS_TO_LOAD = [
-    "tpep_pickup_datetime",
-    "tpep_dropoff_datetime",
-    "trip_distance",
-    "passenger_count",
-    "total_amount",
     "PULocationID",
     "DOLocationID",
 ]
@@ -38,6 +39,22 @@ MAX_DURATION_MINUTES = 240
 MIN_PASSENGERS = 1
 MIN_FARE = 2.5
 VALID_ZONE_RANGE = (1, 263)
+PREFETCH_MONTHS = 3
+
+# Qualifying-trip predicate, evaluated inside the parquet scan
+TRIP_DURATION = pc.subtract(ds.field("tpep_dropoff_datetime"), ds.field("tpep_pickup_datetime"))
+VALID_ZONES = list(range(VALID_ZONE_RANGE[0], VALID_ZONE_RANGE[1] + 1))
+
+TRIP_FILTER = (
+    (ds.field("passenger_count") >= MIN_PASSENGERS) &
+    (ds.field("total_amount") > MIN_FARE) &
+    (ds.field("PULocationID") != ds.field("DOLocationID")) &
+    ds.field("PULocationID").isin(VALID_ZONES) &
+    ds.field("DOLocationID").isin(VALID_ZONES) &
+    (ds.field("trip_distance") > MIN_DISTANCE_MILES) &
+    (TRIP_DURATION >= pa.scalar(timedelta(minutes=MIN_DURATION_MINUTES))) &
+    (TRIP_DURATION <= pa.scalar(timedelta(minutes=MAX_DURATION_MINUTES)))
+)
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
@@ -48,33 +65,44 @@ HEADERS = {
 # 2. HELPERS
 # ======================================================================
 
-def get_file_size_head(url):
-    """Accurate size using HEAD request."""
-    try:
-        r = requests.head(url, headers=HEADERS, timeout=10)
-        if "Content-Length" in r.headers:
-            return int(r.headers["Content-Length"])
-    except:
-        pass
-    return None
+def make_session():
+    """Shared HTTP session so monthly downloads reuse TCP/TLS connections."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+    session.mount("https://", adapter)
+    return session
 
 
-def stream_parquet_in_chunks(url):
+def download_parquet(session, url, dest_dir):
     """
-    Downloads the full parquet and yields each row group.
+    Downloads one monthly parquet to a temporary file and returns its path.
+    Runs on a worker thread so the next months download while this one is processed.
     """
-    global total_bytes_downloaded
+    path = os.path.join(dest_dir, url.split("/")[-1])
 
-    response = requests.get(url, headers=HEADERS, stream=True, timeout=60)
-    response.raise_for_status()
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            for block in response.iter_content(chunk_size=1 << 20):
+                f.write(block)
 
-    content = BytesIO(response.content)
-    total_bytes_downloaded += len(response.content)
+    return path
 
-    parquet_file = pq.ParquetFile(content)
 
-    for rg in range(parquet_file.num_row_groups):
-        yield parquet_file.read_row_group(rg, columns=COLUMNS_TO_LOAD).to_pandas()
+def stream_parquet_in_chunks(path, batch_size=500_000):
+    """
+    Yields Arrow record batches of qualifying trips from a local parquet file.
+    The trip filter is pushed into the parquet scan, so row groups whose
+    statistics cannot match are skipped before decompression.
+    """
+    dataset = ds.dataset(path, format="parquet")
+
+    yield from dataset.to_batches(
+        columns=COLUMNS_TO_LOAD,
+        filter=TRIP_FILTER,
+        batch_size=batch_size,
+    )
 
 
 # ======================================================================
@@ -99,6 +127,12 @@ print("-" * 50)
 print(f"Step 2: Loading crosswalk '{CROSSWALK_FILE}'...")
 df_crosswalk = pd.read_csv(CROSSWALK_FILE)
 
+# Tract IDs are categorical over the crosswalk's tracts, so OD frames carry
+# small integer codes and groupbys hash codes instead of strings
+tract_ids = df_crosswalk["census_tract_id"].astype("string").str.zfill(7)
+tract_dtype = pd.CategoricalDtype(categories=sorted(tract_ids.unique()))
+df_crosswalk["census_tract_id"] = tract_ids.astype(tract_dtype)
+
 pickup_crosswalk = df_crosswalk.rename(columns={
     "LocationID": "PULocationID",
     "census_tract_id": "pickup_tract_id",
@@ -111,7 +145,24 @@ dropoff_crosswalk = df_crosswalk.rename(columns={
     "apportion_weight": "dropoff_weight",
 })
 
-print("Crosswalk loaded")
+# Dense LocationID-indexed lookup for zones that map to exactly one tract;
+# zones split across several tracts still go through the crosswalk merge
+zone_counts = df_crosswalk["LocationID"].value_counts()
+single_zones = df_crosswalk[
+    df_crosswalk["LocationID"].map(zone_counts).eq(1) &
+    df_crosswalk["LocationID"].between(*VALID_ZONE_RANGE)
+]
+single_ids = single_zones["LocationID"].to_numpy()
+
+zone_is_single = np.zeros(VALID_ZONE_RANGE[1] + 1, dtype=bool)
+zone_tract = np.zeros(VALID_ZONE_RANGE[1] + 1, dtype=df_crosswalk["census_tract_id"].cat.codes.dtype)
+zone_weight = np.zeros(VALID_ZONE_RANGE[1] + 1, dtype="float64")
+
+zone_is_single[single_ids] = True
+zone_tract[single_ids] = single_zones["census_tract_id"].cat.codes.to_numpy()
+zone_weight[single_ids] = single_zones["apportion_weight"].to_numpy()
+
+print(f"Crosswalk loaded ({len(single_ids)} single-tract zones use the fast path)")
 print("-" * 50)
 
 # ======================================================================
@@ -123,70 +174,93 @@ print(f"Step 3: Processing {len(TLC_URLS)} monthly files...\n")
 all_months = []
 global_start = time.time()
 
-for i, url in enumerate(tqdm(TLC_URLS, desc="Monthly Files Processed")):
-    label = url.split("/")[-1]
-    print(f"\n  ({i+1}/{len(TLC_URLS)}) {label}")
-    month_start = time.time()
-
-    # -------- 1. Get size via HEAD --------
-    size = get_file_size_head(url)
-    if size:
-        print(f"       File size: {size / (1024**3):.3f} GB")
-    else:
-        print("       File size: Unknown (HEAD failed)")
-
-    od_chunks = []
-
-    # -------- 2. Stream row-groups --------
-    try:
-        for chunk_df in stream_parquet_in_chunks(url):
-
-            chunk_df["tpep_pickup_datetime"] = pd.to_datetime(
-                chunk_df["tpep_pickup_datetime"], errors="coerce")
-            chunk_df["tpep_dropoff_datetime"] = pd.to_datetime(
-                chunk_df["tpep_dropoff_datetime"], errors="coerce")
-
-            chunk_df["duration_min"] = (
-                chunk_df["tpep_dropoff_datetime"] - chunk_df["tpep_pickup_datetime"]
-            ).dt.total_seconds() / 60
-
-            df_filtered = chunk_df[
-                (chunk_df["passenger_count"] >= MIN_PASSENGERS) &
-                (chunk_df["total_amount"] > MIN_FARE) &
-                (chunk_df["PULocationID"] != chunk_df["DOLocationID"]) &
-                (chunk_df["PULocationID"].between(*VALID_ZONE_RANGE)) &
-                (chunk_df["DOLocationID"].between(*VALID_ZONE_RANGE)) &
-                (chunk_df["trip_distance"] > MIN_DISTANCE_MILES) &
-                (chunk_df["duration_min"].between(MIN_DURATION_MINUTES, MAX_DURATION_MINUTES))
-            ][["PULocationID", "DOLocationID"]]
-
-            if df_filtered.empty:
-                continue
-
-            merged = df_filtered.merge(pickup_crosswalk, on="PULocationID", how="inner")
-            merged = merged.merge(dropoff_crosswalk, on="DOLocationID", how="inner")
-
-            merged["trip_fraction"] = merged["pickup_weight"] * merged["dropoff_weight"]
-
-            od_chunks.append(
-                merged.groupby(["pickup_tract_id", "dropoff_tract_id"])["trip_fraction"]
-                .sum()
-                .reset_index()
-            )
-
-        if od_chunks:
-            month_df = pd.concat(od_chunks)
-            all_months.append(month_df)
-            print(f"       ✔ Completed month: {len(month_df)} OD pairs")
-        else:
-            print("       ✔ Completed month: (no qualifying trips)")
-
-    except Exception as e:
-        print(f"      Error processing: {e}")
-
-    # ----- Month time summary -----
-    month_end = time.time()
-    print(f"       Time: {(month_end - month_start):.1f} sec")
+# Keep PREFETCH_MONTHS downloads in flight ahead of the month being processed
+session = make_session()
+download_dir = tempfile.mkdtemp(prefix="tlc_")
+pool = ThreadPoolExecutor(max_workers=PREFETCH_MONTHS)
+try:
+    downloads = {
+        j: pool.submit(download_parquet, session, TLC_URLS[j], download_dir)
+        for j in range(min(PREFETCH_MONTHS, len(TLC_URLS)))
+    }
+
+    for i, url in enumerate(tqdm(TLC_URLS, desc="Monthly Files Processed")):
+        label = url.split("/")[-1]
+        print(f"\n  ({i+1}/{len(TLC_URLS)}) {label}")
+        month_start = time.time()
+
+        next_month = i + PREFETCH_MONTHS
+        if next_month < len(TLC_URLS):
+            downloads[next_month] = pool.submit(download_parquet, session, TLC_URLS[next_month], download_dir)
+
+        od_chunks = []
+        path = None
+
+        try:
+            # -------- 1. Wait for the prefetched file --------
+            path = downloads.pop(i).result()
+            size = os.path.getsize(path)
+            total_bytes_downloaded += size
+            print(f"       File size: {size / (1024**3):.3f} GB")
+
+            # -------- 2. Stream row-groups --------
+            for batch in stream_parquet_in_chunks(path):
+
+                df_filtered = batch.to_pandas()
+
+                if df_filtered.empty:
+                    continue
+
+                pu = df_filtered["PULocationID"].to_numpy()
+                do = df_filtered["DOLocationID"].to_numpy()
+                direct = zone_is_single[pu] & zone_is_single[do]
+
+                # Single-tract zones resolve by array indexing; the rest merge
+                merged = df_filtered[~direct].merge(pickup_crosswalk, on="PULocationID", how="inner")
+                merged = merged.merge(dropoff_crosswalk, on="DOLocationID", how="inner")
+
+                merged = pd.concat([
+                    pd.DataFrame({
+                        "pickup_tract_id": pd.Categorical.from_codes(zone_tract[pu[direct]], dtype=tract_dtype),
+                        "dropoff_tract_id": pd.Categorical.from_codes(zone_tract[do[direct]], dtype=tract_dtype),
+                        "pickup_weight": zone_weight[pu[direct]],
+                        "dropoff_weight": zone_weight[do[direct]],
+                    }),
+                    merged[["pickup_tract_id", "dropoff_tract_id", "pickup_weight", "dropoff_weight"]],
+                ], ignore_index=True)
+
+                merged["trip_fraction"] = merged["pickup_weight"] * merged["dropoff_weight"]
+
+                od_chunks.append(merged[["pickup_tract_id", "dropoff_tract_id", "trip_fraction"]])
+
+            if od_chunks:
+                # One reduction per month keeps memory bounded across 60 files
+                month_df = (
+                    pd.concat(od_chunks, ignore_index=True)
+                    .groupby(["pickup_tract_id", "dropoff_tract_id"], sort=False, observed=True, as_index=False)["trip_fraction"]
+                    .sum()
+                )
+                all_months.append(month_df)
+                print(f"       ✔ Completed month: {len(month_df)} OD pairs")
+            else:
+                print("       ✔ Completed month: (no qualifying trips)")
+
+        except Exception as e:
+            print(f"      Error processing: {e}")
+
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+        # ----- Month time summary -----
+        month_end = time.time()
+        print(f"       Time: {(month_end - month_start):.1f} sec")
+
+finally:
+    # Runs on interrupts too: drop queued downloads, wait out in-flight ones, then clean up
+    pool.shutdown(cancel_futures=True)
+    session.close()
+    shutil.rmtree(download_dir, ignore_errors=True)
 
 # ======================================================================
 # 6. FINAL OD AGGREGATION
@@ -197,19 +271,22 @@ print("\nStep 4: Combining all months...")
 if not all_months:
     print("No months were processed successfully.")
 else:
-    df_all = pd.concat(all_months)
+    df_all = pd.concat(all_months, ignore_index=True)
 
     final = (
-        df_all.groupby(["pickup_tract_id", "dropoff_tract_id"])["trip_fraction"]
+        df_all.groupby(["pickup_tract_id", "dropoff_tract_id"], sort=False, observed=True, as_index=False)["trip_fraction"]
         .sum()
-        .reset_index()
     )
 
     final.rename(columns={"trip_fraction": "total_trips"}, inplace=True)
     final["total_trips"] = final["total_trips"].round(4)
 
+    # Normalize tract IDs once here so consumers read clean 7-digit strings
+    for col in ("pickup_tract_id", "dropoff_tract_id"):
+        final[col] = final[col].astype("string").str.zfill(7)
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    final.to_csv(OUTPUT_FILE, index=False)
+    final.to_parquet(OUTPUT_FILE, engine="pyarrow", compression="zstd", index=False)
 
     print(f"Saved final OD matrix → {OUTPUT_FILE}\n")
     print(final.sort_values("total_trips", ascending=False).head(10))
@@ -228,60 +305,61 @@ print("======================================================")
 OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-input_path = os.path.join(OUTPUT_DIR, "OD_demand_TLC.csv")
+input_path = os.path.join(OUTPUT_DIR, "OD_demand_TLC.parquet")
 neighbors_csv_path = os.path.join(OUTPUT_DIR, "nyc_tract_neighbors_1mile.csv")
-filtered_path = os.path.join(OUTPUT_DIR, "OD_demand_TLC_nonneighbors.csv")
-df_od = pd.read_csv(input_path, dtype=str)
+filtered_path = os.path.join(OUTPUT_DIR, "OD_demand_TLC_nonneighbors.parquet")
+df_od = pd.read_parquet(input_path)
 
 for col in ("pickup_tract_id", "dropoff_tract_id"):
-    df_od[col] = df_od[col].astype(str).str.extract(r"(\d+)")[0].str.zfill(7)
+    df_od[col] = df_od[col].astype("string").str.zfill(7)
 
 print(f"Loaded OD dataset: {len(df_od):,} rows")
 df_od.head()
 
 
-neighbors_dict = {}
-with open(neighbors_csv_path, "r") as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        tid = str(row["tract_id"]).zfill(7)
-        nlist = [n.strip().zfill(7) for n in row["neighbor_ids"].split(",") if n.strip()]
-        neighbors_dict[tid] = set(nlist)
+nb = pd.read_csv(neighbors_csv_path, dtype=str)
+nb["neighbor_ids"] = nb["neighbor_ids"].str.split(",")
+nb = nb.explode("neighbor_ids")
+nb["neighbor_ids"] = nb["neighbor_ids"].str.strip()
+nb = nb[nb["neighbor_ids"].fillna("") != ""]
+nb["tract_id"] = nb["tract_id"].str.zfill(7)
+nb["neighbor_ids"] = nb["neighbor_ids"].str.zfill(7)
+nb = nb.drop_duplicates()
+
+neighbors_dict = nb.groupby("tract_id")["neighbor_ids"].apply(set).to_dict()
 
 print(f"Loaded {len(neighbors_dict):,} neighbor tracts from lookup table.")
-mask = []
-removed_self = removed_neighbor = 0
-
-for o, d in tqdm(zip(df_od["pickup_tract_id"], df_od["dropoff_tract_id"]),
-                 total=len(df_od), desc="Filtering OD pairs"):
-    if o == d:
-        removed_self += 1
-        mask.append(False)
-    elif d in neighbors_dict.get(o, set()):
-        removed_neighbor += 1
-        mask.append(False)
-    else:
-        mask.append(True)
-
-df_filtered = df_od[mask].reset_index(drop=True)
+df_nbr = nb.rename(columns={"tract_id": "origin", "neighbor_ids": "neighbor"})
+matched = df_od.merge(
+    df_nbr,
+    left_on=["pickup_tract_id", "dropoff_tract_id"],
+    right_on=["origin", "neighbor"],
+    how="left", indicator=True
+)
+
+is_self = (matched["pickup_tract_id"] == matched["dropoff_tract_id"]).to_numpy()
+is_neighbor = (matched["_merge"] == "both").to_numpy() & ~is_self
+removed_self = int(is_self.sum())
+removed_neighbor = int(is_neighbor.sum())
+
+df_filtered = df_od[~(is_self | is_neighbor)].reset_index(drop=True)
 
 print(f"Removed self-pairs: {removed_self:,}")
 print(f"Removed neighbor pairs: {removed_neighbor:,}")
 print(f"Kept {len(df_filtered):,} of {len(df_od):,} OD rows")
-df_filtered["total_trips"] = pd.to_numeric(df_filtered["total_trips"], errors="coerce")
 df_filtered = df_filtered.sort_values("total_trips", ascending=False)
 
-df_filtered.to_csv(filtered_path, index=False)
+df_filtered.to_parquet(filtered_path, engine="pyarrow", compression="zstd", index=False)
 print(f"Saved filtered & sorted file to: {filtered_path}")
 
 
 
 # --- 1. LOAD THE FINAL DATASET ---
-FILE_TO_ANALYZE = os.path.join(OUTPUT_DIR, "OD_demand_TLC_nonneighbors.csv")
+FILE_TO_ANALYZE = os.path.join(OUTPUT_DIR, "OD_demand_TLC_nonneighbors.parquet")
 
 print(f"Loading '{FILE_TO_ANALYZE}'...")
 try:
-    df_od = pd.read_csv(FILE_TO_ANALYZE)
+    df_od = pd.read_parquet(FILE_TO_ANALYZE)
     print(f"Success! Loaded file with {len(df_od)} unique O-D pairs.")
     print("\n--- Data Head ---")
     print(df_od.head())
@@ -3,30 +3,35 @@
 
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
 from pathlib import Path
 import geopandas as gpd
-from shapely.geometry import LineString
+from matplotlib.collections import LineCollection
 
 
 OUTPUT_DIR = Path("output")
-tlc_path = OUTPUT_DIR / "OD_demand_TLC_nonneighbors.csv"
-lodes_path = OUTPUT_DIR / "OD_demand_LODES_nonneighbors.csv"
-df_tlc = pd.read_csv(tlc_path)
-df_lodes = pd.read_csv(lodes_path)
+tlc_path = OUTPUT_DIR / "OD_demand_TLC_nonneighbors.parquet"
+lodes_path = OUTPUT_DIR / "OD_demand_LODES_nonneighbors.parquet"
+df_tlc = pd.read_parquet(tlc_path)
+df_lodes = pd.read_parquet(lodes_path)
 
 print(f"TLC rows: {len(df_tlc):,}")
 print(f"LODES rows: {len(df_lodes):,}")
 
 
-
-df_tlc["total_trips"] = pd.to_numeric(df_tlc["total_trips"], errors="coerce")
-df_lodes["total_commuters_2020_2022"] = pd.to_numeric(df_lodes["total_commuters_2020_2022"], errors="coerce")
-
 df_tlc.rename(columns={"pickup_tract_id": "origin_tract", "dropoff_tract_id": "destination_tract"}, inplace=True)
 
+# Shared categorical tract dtype so merges and groupbys hash integer codes, not strings
+od_keys = ["origin_tract", "destination_tract"]
+tract_dtype = pd.CategoricalDtype(sorted(
+    set(df_tlc[od_keys].to_numpy().ravel()) | set(df_lodes[od_keys].to_numpy().ravel())
+))
+df_tlc = df_tlc.astype({k: tract_dtype for k in od_keys})
+df_lodes = df_lodes.astype({k: tract_dtype for k in od_keys})
+
 print(df_tlc.head(), df_lodes.head())
 
 
@@ -45,56 +50,58 @@ print(f"\nScale Ratio (TLC max / LODES max): {ratio:,.1f}x")
 
 fig, axes = plt.subplots(1, 2, figsize=(14,5))
 
-sns.histplot(df_tlc["total_trips"], bins=50, ax=axes[0], log_scale=(False, True))
+counts, edges = np.histogram(df_tlc["total_trips"].to_numpy(), bins=50)
+axes[0].bar(edges[:-1], counts, width=np.diff(edges), align="edge")
+axes[0].set_yscale("log")
 axes[0].set_title("TLC Trip Volume Distribution (log-scale)")
 
-sns.histplot(df_lodes["total_commuters_2020_2022"], bins=50, ax=axes[1], log_scale=(False, True), color='orange')
+counts, edges = np.histogram(df_lodes["total_commuters_2020_2022"].to_numpy(), bins=50)
+axes[1].bar(edges[:-1], counts, width=np.diff(edges), align="edge", color='orange')
+axes[1].set_yscale("log")
 axes[1].set_title("LODES Commuter Volume Distribution (log-scale)")
 
 plt.savefig("images/TLC_vs_LODES_Distribution.png")
 
 
-# Normalize to [0,1] scale for fair comparison
-df_tlc["norm_trips"] = df_tlc["total_trips"] / df_tlc["total_trips"].max()
-df_lodes["norm_commuters"] = df_lodes["total_commuters_2020_2022"] / df_lodes["total_commuters_2020_2022"].max()
+# Normalize to [0,1] scale for fair comparison (float32 is plenty for [0,1] shares)
+df_tlc["norm_trips"] = (df_tlc["total_trips"] / df_tlc["total_trips"].max()).astype("float32")
+df_lodes["norm_commuters"] = (df_lodes["total_commuters_2020_2022"] / df_lodes["total_commuters_2020_2022"].max()).astype("float32")
 
 print("Normalized TLC and LODES sample:")
 print(df_tlc.head(), df_lodes.head())
 
 
 # Merge at OD-level
-combined = pd.merge(
-    df_tlc[["origin_tract", "destination_tract", "norm_trips"]],
-    df_lodes[["origin_tract", "destination_tract", "norm_commuters"]],
-    on=["origin_tract", "destination_tract"], how="outer"
-).fillna(0)
+tlc_od = df_tlc[od_keys + ["norm_trips"]].set_index(od_keys)
+lodes_od = df_lodes[od_keys + ["norm_commuters"]].set_index(od_keys)
+
+combined = (
+    tlc_od.join(lodes_od, how="outer", validate="one_to_one")
+    .fillna(0)
+    .reset_index()
+)
 
 # Equal weighting (50/50 baseline)
-combined["universal_demand"] = 0.5 * combined["norm_trips"] + 0.5 * combined["norm_commuters"]
+combined["universal_demand"] = (0.5 * combined["norm_trips"] + 0.5 * combined["norm_commuters"]).astype("float32")
 
 print(f"Combined Universal Demand Map created: {len(combined):,} rows")
 combined.head()
 
 
 universal_path = OUTPUT_DIR / "Universal_Demand_Map.csv"
-combined.to_csv(universal_path, index=False)
+pacsv.write_csv(pa.Table.from_pandas(combined, preserve_index=False), universal_path)
 print(f"Saved Universal Demand Map to: {universal_path}")
 
 
 
-# Determine which dataset contributed each OD pair
-has_tlc   = combined["norm_trips"] > 0
-has_lodes = combined["norm_commuters"] > 0
-
-# Overlap categories
-both_mask   = has_tlc & has_lodes
-tlc_only    = has_tlc & ~has_lodes
-lodes_only  = ~has_tlc & has_lodes
+# Determine which dataset contributed each OD pair as a 2-bit code:
+# bit 0 = TLC, bit 1 = LODES (1 = TLC only, 2 = LODES only, 3 = both)
+source_code = (combined["norm_trips"] > 0).to_numpy().astype(np.uint8) | (
+    (combined["norm_commuters"] > 0).to_numpy().astype(np.uint8) << 1
+)
 
-# Counts
-n_both  = both_mask.sum()
-n_tlc   = tlc_only.sum()
-n_lodes = lodes_only.sum()
+# Counts for every overlap category in one pass
+_, n_tlc, n_lodes, n_both = np.bincount(source_code, minlength=4)
 n_total = len(combined)
 
 print("OD Pair Overlap Summary")
@@ -113,24 +120,24 @@ plt.savefig("images/OD_Pair_Overlap.png")
 
 
 # Filter only shared pairs
-shared_df = combined[(combined["norm_trips"] > 0) & (combined["norm_commuters"] > 0)].copy()
+shared_df = combined[source_code == 3]
 
-# Compare normalized magnitudes
-shared_df["dominant_source"] = np.where(
-    shared_df["norm_trips"] > shared_df["norm_commuters"], "TLC",
-    np.where(shared_df["norm_trips"] < shared_df["norm_commuters"], "LODES", "Equal")
-)
+shared_trips = shared_df["norm_trips"].to_numpy()
+shared_commuters = shared_df["norm_commuters"].to_numpy()
 
 # Compute aggregate normalized demand totals
-tlc_total = shared_df["norm_trips"].sum()
-lodes_total = shared_df["norm_commuters"].sum()
+tlc_total = shared_trips.sum()
+lodes_total = shared_commuters.sum()
 total_shared_demand = tlc_total + lodes_total
 
 tlc_share = tlc_total / total_shared_demand * 100
 lodes_share = lodes_total / total_shared_demand * 100
 
-# Count dominance
-dominance_counts = shared_df["dominant_source"].value_counts(normalize=True) * 100
+# Count dominance by comparing normalized magnitudes
+tlc_dom = int((shared_trips > shared_commuters).sum())
+lodes_dom = int((shared_trips < shared_commuters).sum())
+equal_dom = len(shared_df) - tlc_dom - lodes_dom
+dominance_counts = pd.Series({"TLC": tlc_dom, "LODES": lodes_dom, "Equal": equal_dom}) / len(shared_df) * 100
 
 print("Demand Contribution Among Shared OD Pairs")
 print(f"Total shared OD pairs: {len(shared_df):,}")
@@ -168,14 +175,25 @@ tract_id_col = tract_id_col_candidates[0] if tract_id_col_candidates else None
 
 print(f"Using '{tract_id_col}' as tract ID column.")
 
-# Create a standardized ID and centroid
-gdf_tracts["TRACT_ID"] = gdf_tracts[tract_id_col].astype(str).str.zfill(7)
-gdf_tracts["centroid"] = gdf_tracts.geometry.centroid
+# Normalize tract ID formats so they align between shapefile and OD file
+raw_ids = gdf_tracts[tract_id_col].astype(str)
+gdf_tracts["TRACT_ID"] = np.where(
+    (raw_ids.str.len() == 11) & raw_ids.str.startswith("36"),  # NYC GEOIDs keep the last 7 digits (Tract code)
+    raw_ids.str[-7:],
+    raw_ids.str.zfill(7),
+)
 
-# Create centroid lookup
-centroid_lookup = gdf_tracts.set_index("TRACT_ID")["centroid"].to_dict()
+# Centroid lookup Series keyed by the normalized tract ID
+centroids = gdf_tracts.geometry.centroid
+cx = centroids.x.to_numpy()
+cy = centroids.y.to_numpy()
+keep = ~gdf_tracts["TRACT_ID"].duplicated(keep="last").to_numpy()
+lon_by_id = pd.Series(cx[keep], index=gdf_tracts["TRACT_ID"].to_numpy()[keep])
+lat_by_id = pd.Series(cy[keep], index=gdf_tracts["TRACT_ID"].to_numpy()[keep])
 
 print(f"Loaded {len(gdf_tracts)} tracts successfully.")
+print(f"Normalized tract IDs to 7-digit codes. Example:")
+print(gdf_tracts[['TRACT_ID']].head())
 
 
 df_univ = combined.copy()
@@ -185,57 +203,26 @@ df_univ["origin_tract"] = df_univ["origin_tract"].astype(str).str.zfill(7)
 df_univ["destination_tract"] = df_univ["destination_tract"].astype(str).str.zfill(7)
 
 # Filter top flows
-top_flows = df_univ.sort_values("universal_demand", ascending=False).head(500)
+top_flows = df_univ.nlargest(500, "universal_demand")
 print(f"Top OD pairs selected: {len(top_flows)}")
 top_flows.head()
 
 
 
 
-# Normalize tract ID formats so they align between shapefile and OD file
-def normalize_geoid(val):
-    s = str(val)
-    if len(s) == 11 and s.startswith("36"):  # NYC GEOIDs
-        return s[-7:]  # keep last 7 digits (Tract code)
-    elif len(s) < 7:
-        return s.zfill(7)
-    else:
-        return s
-
-# Apply normalization to shapefile tract IDs
-gdf_tracts["TRACT_ID"] = gdf_tracts[tract_id_col].apply(normalize_geoid)
-
-# Create centroid dictionary again
-gdf_tracts["centroid"] = gdf_tracts.geometry.centroid
-centroid_lookup = gdf_tracts.set_index("TRACT_ID")["centroid"].to_dict()
-
-print(f"Normalized tract IDs to 7-digit codes. Example:")
-print(gdf_tracts[['TRACT_ID']].head())
-
-
-
+ox = top_flows["origin_tract"].map(lon_by_id).to_numpy(dtype="float64")
+oy = top_flows["origin_tract"].map(lat_by_id).to_numpy(dtype="float64")
+dx = top_flows["destination_tract"].map(lon_by_id).to_numpy(dtype="float64")
+dy = top_flows["destination_tract"].map(lat_by_id).to_numpy(dtype="float64")
 
-flow_lines = []
-missing_count = 0
+found = ~(np.isnan(ox) | np.isnan(dx))
+missing_count = int((~found).sum())
+ox, oy, dx, dy = ox[found], oy[found], dx[found], dy[found]
 
-for _, row in top_flows.iterrows():
-    o, d, w = row["origin_tract"], row["destination_tract"], row["universal_demand"]
-    if o in centroid_lookup and d in centroid_lookup:
-        line = LineString([centroid_lookup[o], centroid_lookup[d]])
-        flow_lines.append({
-            "origin": o,
-            "destination": d,
-            "weight": w,
-            "geometry": line
-        })
-    else:
-        missing_count += 1
+# Origin -> destination segments as an (N, 2, 2) array, ready for a LineCollection
+flow_segments = np.stack([np.column_stack([ox, oy]), np.column_stack([dx, dy])], axis=1)
 
-print(f"Created {len(flow_lines):,} line records. Skipped {missing_count:,} pairs missing tract centroids.")
-
-# Explicitly tell GeoPandas which column is the geometry
-gdf_flows = gpd.GeoDataFrame(flow_lines, geometry="geometry", crs=gdf_tracts.crs)
-print(f"GeoDataFrame successfully created with {len(gdf_flows):,} flow lines.")
+print(f"Created {len(flow_segments):,} flow segments. Skipped {missing_count:,} pairs missing tract centroids.")
 
 
 
@@ -243,9 +230,8 @@ print(f"GeoDataFrame successfully created with {len(gdf_flows):,} flow lines.")
 
 plt.figure(figsize=(10,10))
 base = gdf_tracts.plot(color="lightgrey", linewidth=0.2, figsize=(10,10))
-gdf_flows.sort_values("weight", ascending=False).head(100).plot(
-    ax=base, linewidth=1.5, color="blue", alpha=0.6
-)
+# top_flows is ordered by demand, so the first 100 segments are the top 100 flows
+base.add_collection(LineCollection(flow_segments[:100], linewidths=1.5, colors="blue", alpha=0.6))
 plt.title("Top 100 Flows (Universal Demand Map)")
 plt.axis("off")
 plt.savefig("images/Top100Flows.png")
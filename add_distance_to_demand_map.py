@@ -1,11 +1,30 @@
 import pandas as pd
 import geopandas as gpd
-from itertools import product
+import shapely
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import math
+from numba import njit, prange
 import sys
 
-df = pd.read_csv("output/Universal_Demand_Map.csv", dtype=str)
-gdf = gpd.read_file("nyc_tracts/nyct2020.shp")
+from geo_cache import load_cached_gdf
+
+
+# tract IDs are declared as strings so arrow keeps their leading zeros
+DEMAND_COLUMN_TYPES = {
+    "origin_tract": pa.string(),
+    "destination_tract": pa.string(),
+    "norm_trips": pa.float64(),
+    "norm_commuters": pa.float64(),
+    "universal_demand": pa.float64(),
+    "distance_km": pa.float64(),
+}
+df = pacsv.read_csv(
+    "output/Universal_Demand_Map.csv",
+    convert_options=pacsv.ConvertOptions(column_types=DEMAND_COLUMN_TYPES),
+).to_pandas()
+gdf = load_cached_gdf("nyc_tracts/nyct2020.shp")
 
 gdf = gdf[["BoroCT2020", "geometry"]].copy()
 gdf["BoroCT2020"] = gdf["BoroCT2020"].astype(str)
@@ -14,50 +33,52 @@ if gdf.crs is None:
     gdf = gdf.set_crs(epsg=4326, allow_override=True)
 else:
     gdf = gdf.to_crs(epsg=4326)
-gdf["centroid"] = gdf.geometry.centroid
-centroids = {k: (pt.x, pt.y) for k, pt in zip(gdf["BoroCT2020"], gdf["centroid"]) if pt is not None}
+centroid_geoms = gdf.geometry.centroid.to_numpy()
+has_centroid = ~(shapely.is_missing(centroid_geoms) | shapely.is_empty(centroid_geoms))
+xy = shapely.get_coordinates(centroid_geoms[has_centroid])
+tract_ids = gdf["BoroCT2020"].to_numpy()[has_centroid]
+# duplicate tract IDs keep the last centroid
+keep = ~pd.Series(tract_ids).duplicated(keep="last").to_numpy()
+lon_by_id = pd.Series(xy[keep, 0], index=tract_ids[keep])
+lat_by_id = pd.Series(xy[keep, 1], index=tract_ids[keep])
 
-sample = list(centroids.items())[:10]
+sample = list(zip(tract_ids[:10].tolist(), xy[:10].tolist()))
 print("first 10 centroids:", sample, file=sys.stderr)
 
-df["origin_tract"] = df["origin_tract"].astype(str)
-df["destination_tract"] = df["destination_tract"].astype(str)
-
 origins = sorted(df["origin_tract"].unique())
 dests = sorted(df["destination_tract"].unique())
-all_pairs = set(product(origins, dests))
-existing_pairs = set(zip(df["origin_tract"], df["destination_tract"]))
-missing = all_pairs - existing_pairs
+full_idx = pd.MultiIndex.from_product([origins, dests], names=["origin_tract", "destination_tract"])
+existing_idx = pd.MultiIndex.from_frame(df[["origin_tract", "destination_tract"]])
+missing_idx = full_idx.difference(existing_idx)
 
-if missing:
+if len(missing_idx):
     zero_cols = [c for c in df.columns if c not in ["origin_tract", "destination_tract", "distance_km"]]
-    add_rows = []
-    for o, d in missing:
-        row = {"origin_tract": o, "destination_tract": d}
-        for c in zero_cols:
-            row[c] = 0
-        row["distance_km"] = ""
-        add_rows.append(row)
-    df = pd.concat([df, pd.DataFrame(add_rows)], ignore_index=True)
-
-def haversine(lon1, lat1, lon2, lat2):
-    if None in (lon1, lat1, lon2, lat2):
-        return None
+    n_missing = len(missing_idx)
+    add_df = pd.DataFrame({
+        "origin_tract": missing_idx.get_level_values("origin_tract"),
+        "destination_tract": missing_idx.get_level_values("destination_tract"),
+        **{c: np.zeros(n_missing, dtype=df[c].dtype) for c in zero_cols},
+        "distance_km": np.full(n_missing, np.nan),
+    })
+    df = pd.concat([df, add_df], ignore_index=True)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def haversine(lon1, lat1, lon2, lat2, out):
+    # single fused pass over the coordinate arrays, writing into out
     R = 6371.0
-    dlon = math.radians(lon2 - lon1)
-    dlat = math.radians(lat2 - lat1)
-    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-def row_distance(r):
-    o = r["origin_tract"]
-    d = r["destination_tract"]
-    p1 = centroids.get(o)
-    p2 = centroids.get(d)
-    if p1 is None or p2 is None:
-        return ""
-    return haversine(p1[0], p1[1], p2[0], p2[1])
-
-df["distance_km"] = df.apply(row_distance, axis=1)
-df.to_csv("output/Universal_Demand_Map.csv", index=False)
+    for i in prange(lon1.size):
+        dlon = math.radians(lon2[i] - lon1[i])
+        dlat = math.radians(lat2[i] - lat1[i])
+        a = math.sin(dlat * 0.5) ** 2 + math.cos(math.radians(lat1[i])) * math.cos(math.radians(lat2[i])) * math.sin(dlon * 0.5) ** 2
+        out[i] = 2 * R * math.asin(math.sqrt(a))
+    return out
+
+lon1 = df["origin_tract"].map(lon_by_id).to_numpy(dtype="float64")
+lat1 = df["origin_tract"].map(lat_by_id).to_numpy(dtype="float64")
+lon2 = df["destination_tract"].map(lon_by_id).to_numpy(dtype="float64")
+lat2 = df["destination_tract"].map(lat_by_id).to_numpy(dtype="float64")
+
+# pairs with a missing centroid stay NaN and are written as empty cells
+dist = haversine(lon1, lat1, lon2, lat2, np.empty(len(df)))
+df["distance_km"] = np.where(np.isnan(lat1) | np.isnan(lat2), np.nan, dist)
+pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), "output/Universal_Demand_Map.csv")
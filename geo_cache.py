@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import geopandas as gpd
+import pyogrio
+
+
+def shapefile_mtime(path):
+    """Returns the newest modification time across a shapefile and its sidecar files."""
+    path = Path(path)
+    parts = (path.with_suffix(ext) for ext in ('.shp', '.shx', '.dbf', '.prj'))
+    return max(part.stat().st_mtime for part in parts if part.exists())
+
+
+def load_cached_derived(cache_path, source_path, build, crs, columns=()):
+    """Returns build()'s GeoDataFrame, cached as GeoParquet until the source shapefile changes.
+
+    A cache in a different CRS or without the expected columns is rebuilt.
+    """
+    cache_path = Path(cache_path)
+    if cache_path.exists() and cache_path.stat().st_mtime >= shapefile_mtime(source_path):
+        gdf = gpd.read_parquet(cache_path)
+        if gdf.crs == crs and set(columns) <= set(gdf.columns):
+            return gdf
+        print(f"Cached {cache_path} does not match {crs} with columns {list(columns)}; rebuilding.")
+    gdf = build()
+    gdf.to_parquet(cache_path)
+    return gdf
+
+
+def load_cached_gdf(path):
+    """Reads a shapefile, caching it as GeoParquet next to the source for fast reloads."""
+    # the source CRS comes from the .prj metadata only, without reading any features
+    source_crs = pyogrio.read_info(path)["crs"]
+    return load_cached_derived(
+        Path(path).with_suffix(".parquet"), path,
+        lambda: gpd.read_file(path, engine="pyogrio"),
+        source_crs
+    )
@@ -1,9 +1,24 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import geopandas as gpd
+import shapely
 from random import randint
 import os
 import matplotlib.pyplot as plt
 import seaborn as sns
+
+from geo_cache import load_cached_derived
+
+
+def build_zones():
+    """Dissolves taxi zones by LocationID, projects them and records each zone's area."""
+    zones = gpd.read_file(fp_zones, engine="pyogrio", columns=['LocationID']).dissolve(by='LocationID').reset_index()
+    zones = zones.to_crs(projected_crs)
+    zones['zone_total_area'] = zones.geometry.area
+    return zones
+
+
 # --- TUNABLE PARAMETER ---
 # Set the minimum overlap threshold. A value of 0.01 means we discard any
 # tract that covers less than 1% of the taxi zone's area.
@@ -13,33 +28,57 @@ print("Step 1: Loading shapefiles...")
 fp_zones = 'taxi_zones/taxi_zones.shp'
 fp_tracts = 'nyc_tracts/nyct2020.shp'
 projected_crs = 'EPSG:2263'
+crs_tag = projected_crs.split(':')[-1]
 
 try:
-    zones_raw = gpd.read_file(fp_zones)
-    tracts = gpd.read_file(fp_tracts).to_crs(projected_crs)
+    tracts = load_cached_derived(
+        f'nyc_tracts/nyct2020_{crs_tag}.parquet', fp_tracts,
+        lambda: gpd.read_file(fp_tracts, engine="pyogrio", columns=['BoroCT2020']).to_crs(projected_crs),
+        projected_crs, ['BoroCT2020']
+    )
 except Exception as e:
     print(f"Error loading shapefiles: {e}")
     exit()
 
 print("\nStep 2: Cleaning the Taxi Zone data (Dissolving)...")
-zones = zones_raw.dissolve(by='LocationID').reset_index()
-zones = zones.to_crs(projected_crs)
-print("Taxi zones cleaned.")
-
 print("\nStep 3: Calculating total area for each cleaned taxi zone...")
-zones['zone_total_area'] = zones.geometry.area
+# Dissolve, reprojection and areas are cached, so reruns skip all three
+try:
+    zones = load_cached_derived(
+        f'taxi_zones/zones_dissolved_{crs_tag}.parquet', fp_zones, build_zones,
+        projected_crs, ['LocationID', 'zone_total_area']
+    )
+except Exception as e:
+    print(f"Error loading shapefiles: {e}")
+    exit()
+print("Taxi zones cleaned.")
 
 print("\nStep 4: Performing spatial intersection...")
-intersection = gpd.overlay(
+# Candidate tract/zone pairs come from the spatial index; each pair is then
+# intersected in one vectorized Shapely call instead of a full overlay
+intersection = gpd.sjoin(
     tracts[['BoroCT2020', 'geometry']],
     zones[['LocationID', 'zone_total_area', 'geometry']],
-    how='intersection'
+    predicate='intersects',
+    how='inner'
+)
+zone_geoms = zones.geometry.loc[intersection['index_right']].to_numpy()
+intersection['intersect_area'] = shapely.area(
+    shapely.intersection(intersection.geometry.to_numpy(), zone_geoms)
 )
+intersection = intersection[intersection['intersect_area'] > 0]
 
 print("\nStep 5: Aggregating MultiPolygon results and calculating initial weights...")
-# First, sum up pieces of the same tract within the same zone (handles MultiPolygons)
-intersection['intersect_area'] = intersection.geometry.area
-agg_intersection = intersection.groupby(['LocationID', 'BoroCT2020', 'zone_total_area']).agg({'intersect_area': 'sum'}).reset_index()
+# Sum up pieces of the same tract within the same zone (only needed if a tract has several rows)
+agg_cols = ['LocationID', 'BoroCT2020', 'zone_total_area']
+if intersection.duplicated(['LocationID', 'BoroCT2020']).any():
+    agg_intersection = intersection.groupby(agg_cols).agg({'intersect_area': 'sum'}).reset_index()
+else:
+    agg_intersection = (
+        pd.DataFrame(intersection[agg_cols + ['intersect_area']])
+        .sort_values(['LocationID', 'BoroCT2020'])
+        .reset_index(drop=True)
+    )
 
 # Calculate the initial weight based on the summed area
 agg_intersection['apportion_weight'] = agg_intersection['intersect_area'] / agg_intersection['zone_total_area']
@@ -52,12 +91,9 @@ print(f"Removed rows with tiny weights. Kept {len(filtered_crosswalk)} significa
 print("\nStep 7: Re-Normalizing weights to ensure they sum to 1...")
 # --- RE-NORMALIZATION STEP ---
 # After filtering, the weights for a zone no longer sum to 1. We must fix this.
-weight_sums = filtered_crosswalk.groupby('LocationID')['apportion_weight'].sum().to_dict()
+weight_sums = filtered_crosswalk.groupby('LocationID')['apportion_weight'].transform('sum')
 
-filtered_crosswalk['apportion_weight_normalized'] = filtered_crosswalk.apply(
-    lambda row: row['apportion_weight'] / weight_sums[row['LocationID']],
-    axis=1
-)
+filtered_crosswalk['apportion_weight_normalized'] = filtered_crosswalk['apportion_weight'] / weight_sums
 print("Remaining weights have been re-normalized.")
 
 print("\nStep 8: Building and exporting the crosswalk file...")
@@ -72,7 +108,9 @@ if not os.path.exists('output'):
     print("Created 'output' subfolder.")
 
 output_filename = 'output/nyc_zone_tract_crosswalk.csv'
-final_crosswalk.to_csv(output_filename, index=False, float_format='%.6f')
+# Round once up front instead of formatting every float on write
+final_crosswalk['apportion_weight'] = final_crosswalk['apportion_weight'].round(6)
+pacsv.write_csv(pa.Table.from_pandas(final_crosswalk, preserve_index=False), output_filename)
 
 print("-" * 50)
 print(f"Success! Your crosswalk file is ready: {output_filename}")